@@ -4,35 +4,436 @@ Proxy server for PHP API with static file serving
 Handles both API requests and static files
 """
 
+import http.client
 import http.server
-import socketserver
+import socket
 import subprocess
 import os
+import re
+import stat
+import errno
+import selectors
+import mmap
+import shutil
 import mimetypes
-import urllib.request
-import urllib.error
+import functools
+import queue
+import threading
+import time
+import collections
+import contextlib
 
 PORT = 8000
 PHP_PORT = 8080
+PHP_WORKERS = 16
 API_DIR = os.path.dirname(os.path.abspath(__file__))
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    daemon_threads = True
+# Fixed CORS headers, pre-encoded once instead of formatted per response
+_CORS_BYTES = (
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Access-Control-Allow-Methods: GET, POST, PUT, DELETE, OPTIONS\r\n'
+    b'Access-Control-Allow-Headers: *\r\n'
+)
+
+# Complete preflight response, cacheable by the browser for a day
+_OPTIONS_BLOB = (
+    b'HTTP/1.1 204 No Content\r\n' + _CORS_BYTES +
+    b'Access-Control-Max-Age: 86400\r\n'
+    b'Content-Length: 0\r\n'
+    b'\r\n'
+)
+
+# Constant headers shared by every static file response
+_STATIC_BYTES = (
+    b'Cache-Control: public, max-age=86400\r\n'
+    b'Accept-Ranges: bytes\r\n'
+    b'Vary: Accept-Encoding\r\n'
+) + _CORS_BYTES
+
+# Precompressed sibling files tried in order of preference, as
+# (Content-Encoding, file suffix), for text-like content types only
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+_COMPRESSIBLE_TYPES = frozenset({
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+})
+
+# Lowercased header names not copied between client and PHP
+_SKIP_REQ = frozenset({
+    'host', 'content-length', 'connection', 'transfer-encoding', 'te',
+    'keep-alive', 'upgrade', 'proxy-connection',
+})
+_SKIP_RESP = frozenset({'transfer-encoding', 'connection'})
+
+# A single byte range; multipart range requests are served in full
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+@functools.lru_cache(maxsize=256)
+def guess_content_type(ext):
+    """Map a lowercase file extension to its content type"""
+    content_type, _ = mimetypes.guess_type('x' + ext)
+    return content_type or 'application/octet-stream'
+
+class FileCache:
+    """LRU cache of small static files' contents, validated against their stat"""
+    
+    def __init__(self, maxsize=512, max_content_size=64 * 1024):
+        self.maxsize = maxsize
+        self.max_content_size = max_content_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def lookup(self, path, st):
+        """Return the contents of path, or None if it is too large to cache"""
+        if st.st_size > self.max_content_size:
+            return None
+        
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(path)
+                return entry[1]
+        
+        with open(path, 'rb') as f:
+            data = f.read()
+        
+        with self._lock:
+            self._entries[path] = (version, data)
+            self._entries.move_to_end(path)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return data
+
+_file_cache = FileCache()
+
+class CachedFd:
+    """An open descriptor shared by requests, closed once retired and unused"""
+    __slots__ = ('fd', 'version', 'users', 'retired')
+    
+    def __init__(self, fd, version):
+        self.fd = fd
+        self.version = version
+        self.users = 0
+        self.retired = False
+
+class FdCache:
+    """LRU cache of open read-only descriptors for frequently served files"""
+    
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def open(self, path, st):
+        """Yield a descriptor for path, reusing a cached one while it is unchanged"""
+        version = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(path)
+                entry.users += 1
+            else:
+                entry = None
+        
+        if entry is None:
+            fd = os.open(path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0))
+            entry = CachedFd(fd, version)
+            entry.users = 1
+            with self._lock:
+                old = self._entries.pop(path, None)
+                if old is not None:
+                    self._retire(old)
+                self._entries[path] = entry
+                while len(self._entries) > self.maxsize:
+                    self._retire(self._entries.popitem(last=False)[1])
+        
+        try:
+            yield entry.fd
+        finally:
+            with self._lock:
+                entry.users -= 1
+                if entry.retired and entry.users == 0:
+                    os.close(entry.fd)
+    
+    def _retire(self, entry):
+        # Called with the lock held; in-flight requests close it on release
+        entry.retired = True
+        if entry.users == 0:
+            os.close(entry.fd)
+
+# Cached descriptors are shared between threads, so only keep them where
+# positional reads leave the file offset alone in the non-sendfile fallback
+_fd_cache = FdCache(256 if hasattr(os, 'pread') else 0)
+
+class ThreadPoolMixIn:
+    """Handle requests on a fixed pool of daemon worker threads
+    
+    A connection only holds a worker while a request is being served. Between
+    requests it waits in a selector, so an idle keep-alive socket costs a file
+    descriptor rather than a thread.
+    """
+    pool_size = 64
+    # Seconds a connection may sit idle waiting for its next request
+    idle_timeout = 15
+    
+    def server_activate(self):
+        super().server_activate()
+        self._requests = queue.SimpleQueue()
+        self._parked = queue.SimpleQueue()
+        self._wakeup, self._waker = socket.socketpair()
+        self._waker.setblocking(False)
+        threading.Thread(target=self._idle_loop, daemon=True).start()
+        for _ in range(self.pool_size):
+            threading.Thread(target=self._worker, daemon=True).start()
+    
+    def _worker(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            else:
+                if getattr(handler, 'keep_alive', False):
+                    self.park(request, client_address)
+                    continue
+            self.shutdown_request(request)
+    
+    def _idle_loop(self):
+        next_sweep = 0
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wakeup, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select(1):
+                    if key.fileobj is self._wakeup:
+                        self._wakeup.recv(4096)
+                    else:
+                        # The next request has arrived; hand it to a worker
+                        selector.unregister(key.fileobj)
+                        self._requests.put((key.fileobj, key.data[0]))
+                
+                now = time.monotonic()
+                while True:
+                    try:
+                        request, client_address = self._parked.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        selector.register(request, selectors.EVENT_READ,
+                                          (client_address, now + self.idle_timeout))
+                    except (OSError, ValueError):
+                        self.shutdown_request(request)
+                
+                if now >= next_sweep:
+                    next_sweep = now + 1
+                    for key in list(selector.get_map().values()):
+                        if key.data is not None and key.data[1] <= now:
+                            selector.unregister(key.fileobj)
+                            self.shutdown_request(key.fileobj)
+    
+    def park(self, request, client_address):
+        """Wait for the connection's next request without holding a worker"""
+        self._parked.put((request, client_address))
+        try:
+            self._waker.send(b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+    
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+    
+    def process_request(self, request, client_address):
+        # New connections wait for their first request the same way
+        self.park(request, client_address)
+
+class ThreadedHTTPServer(ThreadPoolMixIn, http.server.HTTPServer):
     allow_reuse_address = True
+    request_queue_size = 4096
+    # Fixed send/receive buffer size; None keeps the kernel's autotuning,
+    # which a fixed size would switch off
+    socket_buffer_size = None
+    
+    def server_bind(self):
+        # Set on the listening socket so accepted connections inherit it and
+        # the receive window scale is negotiated during the handshake
+        if self.socket_buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.socket_buffer_size)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.socket_buffer_size)
+        super().server_bind()
+    
+    def get_request(self):
+        request, client_address = super().get_request()
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return request, client_address
 
-class ProxyHandler(http.server.BaseHTTPRequestHandler):
+class KeepAliveHandlerMixIn:
+    """HTTP/1.1 request handling that hands idle connections back to ThreadPoolMixIn"""
+    protocol_version = 'HTTP/1.1'
+    # Bounds each read and write while a request is in progress; idle
+    # connections are timed out by the server's selector instead
+    timeout = 15
+    # Set when the connection should wait for another request
+    keep_alive = False
+    
+    def handle(self):
+        """Serve the requests already sent on this connection, then let it idle"""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            try:
+                waiting = self.request_waiting()
+            except OSError:
+                return
+            if not waiting:
+                # Park it with the server rather than block a worker on it
+                self.keep_alive = True
+                return
+            self.handle_one_request()
+    
+    def parse_request(self):
+        """Also refuse request bodies whose end can't be found from Content-Length"""
+        if not super().parse_request():
+            return False
+        # Bodies are only ever read by length, so an unread chunked body
+        # would otherwise be parsed as the next request on this connection
+        if 'Transfer-Encoding' in self.headers:
+            self.send_error(411, 'Chunked request bodies are not supported')
+            return False
+        lengths = self.headers.get_all('Content-Length', [])
+        if len(lengths) > 1 or (lengths and not lengths[0].strip().isdecimal()):
+            self.send_error(400, 'Bad Content-Length')
+            return False
+        return True
+    
+    def ignore_body(self):
+        """Close the connection after responding if the request sent a body that isn't read"""
+        if int(self.headers.get('Content-Length') or 0):
+            self.close_connection = True
+    
+    def request_waiting(self):
+        """Whether the next request has started arriving, checked without blocking"""
+        timeout = self.connection.gettimeout()
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        finally:
+            self.connection.settimeout(timeout)
+
+class FileResponseMixIn:
+    """Byte ranges and zero-copy transfer for handlers that serve files"""
+    
+    def not_modified(self, etag):
+        """Whether If-None-Match lists this ETag, using the weak comparison it calls for"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag == '*' or tag.removeprefix('W/') == etag:
+                return True
+        return False
+    
+    def parse_range(self, file_size, etag):
+        """Return the (start, end) byte range requested, or None for the whole file"""
+        header = self.headers.get('Range')
+        if not header:
+            return None
+        # A stale If-Range validator means the client wants the whole new file
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range != etag:
+            return None
+        
+        match = _RANGE_RE.match(header.strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last), file_size - 1) if last else file_size - 1
+        elif last:
+            # Suffix range: the final N bytes
+            start = max(file_size - int(last), 0)
+            end = file_size - 1
+        else:
+            return None
+        # start > end marks an unsatisfiable range
+        return start, end
+    
+    def wait_writable(self):
+        """Block until the client socket can take more data, up to the handler timeout"""
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.connection, selectors.EVENT_WRITE)
+            if not selector.select(self.connection.gettimeout()):
+                raise TimeoutError('timed out sending file')
+    
+    def send_file(self, fd, offset, count):
+        """Send count bytes of fd starting at offset, zero-copy when possible"""
+        self.wfile.flush()
+        out_fd = self.wfile.fileno()
+        try:
+            while count > 0:
+                try:
+                    sent = os.sendfile(out_fd, fd, offset, count)
+                except BlockingIOError:
+                    # The handler timeout leaves the socket non-blocking
+                    self.wait_writable()
+                    continue
+                if sent == 0:
+                    # The file shrank, so the promised length can't be met
+                    self.close_connection = True
+                    break
+                offset += sent
+                count -= sent
+            return
+        except AttributeError:
+            pass
+        except OSError as e:
+            if e.errno != errno.ENOSYS:
+                raise
+        
+        # Fallback for platforms without sendfile(2)
+        if 0 < count <= 2 * 1024 * 1024:
+            # Map medium-sized files and write them out in one call
+            with mmap.mmap(fd, offset + count, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    self.wfile.write(view[offset:offset + count])
+            return
+        
+        if not hasattr(os, 'pread'):
+            os.lseek(fd, offset, os.SEEK_SET)
+        while count > 0:
+            if hasattr(os, 'pread'):
+                chunk = os.pread(fd, min(8192, count), offset)
+            else:
+                chunk = os.read(fd, min(8192, count))
+            if not chunk:
+                self.close_connection = True
+                break
+            self.wfile.write(chunk)
+            offset += len(chunk)
+            count -= len(chunk)
+
+class ProxyHandler(KeepAliveHandlerMixIn, FileResponseMixIn,
+                   http.server.BaseHTTPRequestHandler):
     def send_cors_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer.append(_CORS_BYTES)
+    
+    def send_static_headers(self):
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer.append(_STATIC_BYTES)
     
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_cors_headers()
-        self.end_headers()
+        self.ignore_body()
+        self.wfile.write(_OPTIONS_BLOB)
+        self.log_request(204)
     
     def do_GET(self):
-        path = self.path.split('?')[0]
+        q = self.path.find('?')
+        path = self.path if q < 0 else self.path[:q]
         
         # Serve static files
         if path.startswith('/uploads/'):
@@ -50,81 +451,161 @@ class ProxyHandler(http.server.BaseHTTPRequestHandler):
         self.proxy_to_php()
     
     def serve_static_file(self, path):
+        self.ignore_body()
         file_path = os.path.join(API_DIR, path.lstrip('/'))
         
-        if not os.path.isfile(file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            st = None
+        if st is None or not stat.S_ISREG(st.st_mode):
             self.send_error(404, 'File not found')
             return
         
         try:
-            content_type, _ = mimetypes.guess_type(file_path)
-            if content_type is None:
-                content_type = 'application/octet-stream'
+            content_type = guess_content_type(os.path.splitext(file_path)[1].lower())
+            
+            # Serve a precompressed sibling if the client accepts it
+            encoding = None
+            if content_type.startswith('text/') or content_type in _COMPRESSIBLE_TYPES:
+                encoding, file_path, st = self.find_encoded_variant(file_path, st)
+            
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            if encoding is not None:
+                etag = f'{etag[:-1]}-{encoding}"'
+            
+            # Let the client revalidate its cached copy without a body
+            if self.not_modified(etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_static_headers()
+                self.end_headers()
+                return
+            
+            data = _file_cache.lookup(file_path, st)
+            file_size = len(data) if data is not None else st.st_size
             
-            file_size = os.path.getsize(file_path)
+            byte_range = self.parse_range(file_size, etag)
+            if byte_range is None:
+                self.send_response(200)
+                offset, count = 0, file_size
+            else:
+                start, end = byte_range
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{file_size}')
+                    self.send_header('Content-Length', '0')
+                    self.send_static_headers()
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+                offset, count = start, end - start + 1
             
-            self.send_response(200)
             self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', str(file_size))
-            self.send_cors_headers()
-            self.send_header('Cache-Control', 'public, max-age=86400')
+            self.send_header('Content-Length', str(count))
+            if encoding is not None:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('ETag', etag)
+            self.send_static_headers()
             self.end_headers()
             
-            with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(8192)
-                    if not chunk:
-                        break
-                    self.wfile.write(chunk)
+            # Small files are served straight from the cache
+            if data is not None:
+                self.wfile.write(data[offset:offset + count])
+                return
+            
+            with _fd_cache.open(file_path, st) as fd:
+                self.send_file(fd, offset, count)
         except Exception as e:
             print(f"Error serving file: {e}")
+            self.close_connection = True
+    
+    def find_encoded_variant(self, file_path, st):
+        """Return (encoding, path, stat) of the best precompressed file to send"""
+        accept = self.headers.get('Accept-Encoding')
+        if accept:
+            # Codings the client accepts, leaving out any refused with q=0
+            accepted = set()
+            for token in accept.lower().split(','):
+                coding, _, params = token.partition(';')
+                q = params.strip()
+                if q.startswith('q='):
+                    try:
+                        if float(q[2:]) <= 0:
+                            continue
+                    except ValueError:
+                        continue
+                accepted.add(coding.strip())
+            for encoding, suffix in _ENCODINGS:
+                if encoding not in accepted:
+                    continue
+                try:
+                    encoded_st = os.stat(file_path + suffix)
+                except OSError:
+                    continue
+                if stat.S_ISREG(encoded_st.st_mode):
+                    return encoding, file_path + suffix, encoded_st
+        return None, file_path, st
     
     def proxy_to_php(self):
+        # php -S answers every request with Connection: close, so a fresh
+        # connection per request is all the backend supports
+        conn = http.client.HTTPConnection('127.0.0.1', PHP_PORT, timeout=30)
+        headers_sent = False
         try:
-            url = f'http://127.0.0.1:{PHP_PORT}{self.path}'
-            
             # Read request body if present
-            content_length = int(self.headers.get('Content-Length', 0))
+            cl = self.headers.get('Content-Length')
+            content_length = int(cl) if cl else 0
             body = self.rfile.read(content_length) if content_length > 0 else None
             
-            # Create request
-            req = urllib.request.Request(url, data=body, method=self.command)
-            
-            # Copy headers
-            for header, value in self.headers.items():
-                if header.lower() not in ['host', 'content-length']:
-                    req.add_header(header, value)
+            # Copy headers, leaving hop-by-hop framing to the backend connection
+            headers = {}
+            for header, value in self.headers.raw_items():
+                if header.lower() not in _SKIP_REQ:
+                    headers[header] = value
             
             # Make request to PHP
-            with urllib.request.urlopen(req, timeout=30) as response:
-                self.send_response(response.status)
-                
-                # Track if CORS headers already sent by PHP
-                cors_sent = False
-                
-                for header, value in response.headers.items():
-                    header_lower = header.lower()
-                    if header_lower not in ['transfer-encoding', 'connection']:
-                        # Skip CORS headers from PHP, we'll add our own
-                        if header_lower.startswith('access-control-'):
-                            cors_sent = True
-                            continue
-                        self.send_header(header, value)
-                
-                # Always add our CORS headers (only once)
-                self.send_cors_headers()
-                self.end_headers()
-                
-                self.wfile.write(response.read())
-                
-        except urllib.error.HTTPError as e:
-            self.send_response(e.code)
+            conn.request(self.command, self.path, body, headers)
+            response = conn.getresponse()
+            self.send_response(response.status)
+            
+            # Track if CORS headers already sent by PHP
+            cors_sent = False
+            
+            for header, value in response.headers.raw_items():
+                header_lower = header.lower()
+                if header_lower in _SKIP_RESP:
+                    continue
+                # Skip CORS headers from PHP, we'll add our own
+                if header_lower.startswith('access-control-'):
+                    cors_sent = True
+                    continue
+                self.send_header(header, value)
+            
+            # Without a length the body can only end with the connection
+            if response.length is None:
+                self.send_header('Connection', 'close')
+            
+            # Always add our CORS headers (only once)
             self.send_cors_headers()
             self.end_headers()
-            self.wfile.write(e.read())
+            headers_sent = True
+            
+            # Stream the body instead of buffering it in memory
+            shutil.copyfileobj(response, self.wfile, 65536)
+            
         except Exception as e:
             print(f"Proxy error: {e}")
-            self.send_error(502, f'Bad Gateway: {e}')
+            if headers_sent:
+                # Part of the response is already out; all we can do is drop it
+                self.close_connection = True
+            else:
+                # Discard any headers buffered from a half-built response
+                self._headers_buffer = []
+                self.send_error(502, f'Bad Gateway: {e}')
+        finally:
+            conn.close()
     
     def log_message(self, format, *args):
         print(f"[{self.log_date_time_string()}] {args[0]}")
@@ -137,13 +618,14 @@ if __name__ == '__main__':
     os.environ['JWT_SECRET'] = 'yemen_cars_super_secret_key_2026_minimum_32_chars'
     os.environ['APP_ENV'] = 'development'
     
-    # Start PHP server in background with environment
-    print(f"Starting PHP server on port {PHP_PORT}...")
+    # Start PHP server in background with environment; PHP_CLI_SERVER_WORKERS
+    # makes it fork a pool of workers instead of serving one request at a time
+    print(f"Starting PHP server on port {PHP_PORT} with {PHP_WORKERS} workers...")
     php_process = subprocess.Popen(
         ['php', '-S', f'127.0.0.1:{PHP_PORT}', '-t', API_DIR],
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
-        env={**os.environ}
+        env={**os.environ, 'PHP_CLI_SERVER_WORKERS': str(PHP_WORKERS)}
     )
     
     print(f"Starting proxy server on http://0.0.0.0:{PORT}")
@@ -5,20 +5,42 @@ Handles concurrent connections better than the default http.server
 """
 
 import http.server
-import socketserver
 import os
+import stat
 import sys
 import mimetypes
 
+# The pooled server and shared handler behaviour live alongside in server.py
+from server import (
+    ThreadedHTTPServer, KeepAliveHandlerMixIn, FileResponseMixIn, guess_content_type,
+)
+
 PORT = 8001
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
-class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
-    """Handle requests in a separate thread."""
-    daemon_threads = True
-    allow_reuse_address = True
+# Fixed CORS headers, pre-encoded once instead of formatted per response
+_CORS_BYTES = (
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Access-Control-Allow-Methods: GET, OPTIONS\r\n'
+    b'Access-Control-Allow-Headers: *\r\n'
+)
+
+# Complete preflight response, cacheable by the browser for a day
+_OPTIONS_BLOB = (
+    b'HTTP/1.1 204 No Content\r\n' + _CORS_BYTES +
+    b'Access-Control-Max-Age: 86400\r\n'
+    b'Content-Length: 0\r\n'
+    b'\r\n'
+)
+
+# Constant headers shared by every static file response
+_STATIC_BYTES = (
+    b'Cache-Control: public, max-age=86400\r\n'
+    b'Accept-Ranges: bytes\r\n'
+) + _CORS_BYTES
 
-class CORSRequestHandler(http.server.SimpleHTTPRequestHandler):
+class CORSRequestHandler(KeepAliveHandlerMixIn, FileResponseMixIn,
+                         http.server.SimpleHTTPRequestHandler):
     """HTTP request handler with CORS support."""
     
     def __init__(self, *args, **kwargs):
@@ -26,48 +48,77 @@ class CORSRequestHandler(http.server.SimpleHTTPRequestHandler):
     
     def do_GET(self):
         """Handle GET requests with proper streaming."""
+        self.ignore_body()
+        
         # Parse the path
-        path = self.translate_path(self.path.split('?')[0])
+        q = self.path.find('?')
+        path = self.translate_path(self.path if q < 0 else self.path[:q])
         
-        if os.path.isfile(path):
-            # Get file info
-            file_size = os.path.getsize(path)
+        # A single stat both checks for a regular file and gives its size
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        
+        if st is not None and stat.S_ISREG(st.st_mode):
+            file_size = st.st_size
+            etag = f'"{st.st_mtime_ns:x}-{file_size:x}"'
+            
+            # Answer revalidation of an unchanged file without a body
+            if self.not_modified(etag):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_static_headers()
+                self.end_headers()
+                return
             
             # Determine content type
-            content_type, _ = mimetypes.guess_type(path)
-            if content_type is None:
-                content_type = 'application/octet-stream'
+            content_type = guess_content_type(os.path.splitext(path)[1].lower())
+            
+            # Send the whole file or just the requested byte range
+            byte_range = self.parse_range(file_size, etag)
+            if byte_range is None:
+                self.send_response(200)
+                offset, count = 0, file_size
+            else:
+                start, end = byte_range
+                if start > end:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{file_size}')
+                    self.send_header('Content-Length', '0')
+                    self.send_static_headers()
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{file_size}')
+                offset, count = start, end - start + 1
             
             # Send response headers
-            self.send_response(200)
             self.send_header('Content-Type', content_type)
-            self.send_header('Content-Length', str(file_size))
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-            self.send_header('Access-Control-Allow-Headers', '*')
-            self.send_header('Cache-Control', 'public, max-age=86400')
-            self.send_header('Connection', 'keep-alive')
+            self.send_header('Content-Length', str(count))
+            self.send_header('ETag', etag)
+            self.send_static_headers()
             self.end_headers()
             
             # Stream the file
             try:
                 with open(path, 'rb') as f:
-                    while True:
-                        chunk = f.read(65536)  # 64KB chunks
-                        if not chunk:
-                            break
-                        self.wfile.write(chunk)
-            except (BrokenPipeError, ConnectionResetError):
-                pass
+                    self.send_file(f.fileno(), offset, count)
+            except (BrokenPipeError, ConnectionResetError, TimeoutError):
+                self.close_connection = True
         else:
             super().do_GET()
     
+    def send_static_headers(self):
+        """Append the pre-encoded caching and CORS headers."""
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer.append(_STATIC_BYTES)
+    
     def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
-        self.end_headers()
+        """Answer CORS preflight with a pre-encoded response."""
+        self.ignore_body()
+        self.wfile.write(_OPTIONS_BLOB)
+        self.log_request(204)
     
     def log_message(self, format, *args):
         """Log messages."""